@@ -0,0 +1,173 @@
+import numpy as np
+
+CHUNK_SIZE = 32
+COVERED = 'C'
+MINE = 'M'
+UNCOVERED = 'U'
+
+class ChunkedBoard:
+	"""
+	Sparse storage for a Minesweeper board. Tiles live in fixed-size chunks that
+	are only allocated once something in them is revealed, so memory follows the
+	revealed area instead of the board area.
+
+	Pass rows=None and columns=None for an unbounded board. That only covers
+	storage, neighbors and vectors: `covered` is None and `find('C')` raises,
+	and `Board` still needs a bounded board since it plays a fixed screen
+	rectangle and counts the remaining tiles and mines.
+	"""
+	def __init__(self, rows=None, columns=None, size=CHUNK_SIZE):
+		self.rows = rows
+		self.columns = columns
+		self.size = size
+		self.chunks = {}
+		self.revealed = 0
+		self.flagged = 0
+		self.changed = set()
+
+	@property
+	def shape(self):
+		return (self.rows, self.columns)
+
+	@property
+	def bounded(self):
+		return self.rows is not None and self.columns is not None
+
+	@property
+	def covered(self):
+		"""
+		Number of covered tiles, or None for an unbounded board.
+		"""
+		if not self.bounded:
+			return None
+		return self.rows * self.columns - self.revealed
+
+	def __getitem__(self, rc):
+		row, column = rc
+		chunk = self.chunks.get((row // self.size, column // self.size))
+		if chunk is None:
+			return COVERED
+		return chunk[row % self.size, column % self.size]
+
+	def __setitem__(self, rc, value):
+		row, column = rc
+		key = (row // self.size, column // self.size)
+		chunk = self.chunks.get(key)
+		if chunk is None:
+			if value == COVERED:
+				return
+			chunk = self._allocate(key)
+		local = (row % self.size, column % self.size)
+		old = chunk[local]
+		if old == value:
+			return
+		chunk[local] = value
+		self.revealed += (value != COVERED) - (old != COVERED)
+		self.flagged += (value == MINE) - (old == MINE)
+		self.changed.add((row, column))
+
+	def _allocate(self, key):
+		chunk = np.full((self.size, self.size), COVERED, dtype='<U1')
+		self.chunks[key] = chunk
+		return chunk
+
+	def in_bounds(self, row, column):
+		if self.bounded:
+			return 0 <= row < self.rows and 0 <= column < self.columns
+		return True
+
+	def neighbors(self, row, column):
+		"""
+		Return all neighbor coordinates.
+		:return: set of tuples in the form {(1,2),(2,3)}
+		"""
+		neighbors = set()
+		for row2 in range(row-1, row+2):
+			for column2 in range(column-1, column+2):
+				if (row != row2 or column != column2) and self.in_bounds(row2, column2):
+					neighbors.add((row2, column2))
+		return neighbors
+
+	def vector(self, location):
+		"""
+		Returns the vector rooted at a numbered tile, or None if the tile is not
+		numbered or has no covered neighbors.
+		:return: dict in the form {'root': (0,0), 'vector': [(0,1),(1,0)], 'mines': 1}
+		"""
+		value = self[location]
+		if value in (COVERED, MINE, UNCOVERED):
+			return None
+		mines = int(value)
+		covered = []
+		for coord in self.neighbors(*location):
+			neighbor = self[coord]
+			if neighbor == MINE:
+				mines = mines - 1
+			elif neighbor == COVERED:
+				covered.append(coord)
+
+		if len(covered) == 0:
+			return None
+
+		return {
+			'root': location,
+			'vector': covered,
+			'mines': mines
+		}
+
+	def update(self, board):
+		"""
+		Merges a dense capture into the chunks one chunk-sized window at a time.
+		Windows that are still fully covered are never allocated.
+		:param board: numpy array in the form [['M','C','1',...,'X'],[...]]
+		:return: None
+		"""
+		rows, columns = board.shape
+		for top in range(0, rows, self.size):
+			for left in range(0, columns, self.size):
+				window = board[top:top+self.size, left:left+self.size]
+				key = (top // self.size, left // self.size)
+				chunk = self.chunks.get(key)
+				if chunk is None:
+					current = COVERED
+				else:
+					current = chunk[:window.shape[0], :window.shape[1]]
+				for r, c in np.transpose((window != current).nonzero()):
+					self[(int(top + r), int(left + c))] = window[r, c]
+		return None
+
+	def changes(self):
+		"""
+		Returns and clears the tiles that changed since the last call.
+		:return: set of tuples in the form {(1,2),(2,3)}
+		"""
+		changed = self.changed
+		self.changed = set()
+		return changed
+
+	def find(self, value):
+		"""
+		Returns every coordinate holding `value`. Covered tiles are only
+		enumerable on a bounded board.
+		:return: list of tuples in the form [(1,2),(2,3)]
+		"""
+		found = []
+		if value == COVERED:
+			if not self.bounded:
+				raise ValueError('Covered tiles of an unbounded board are not enumerable.')
+			keys = [(r, c) for r in range(-(-self.rows // self.size))
+						   for c in range(-(-self.columns // self.size))]
+		else:
+			keys = list(self.chunks.keys())
+
+		for key in keys:
+			chunk = self.chunks.get(key)
+			top, left = key[0] * self.size, key[1] * self.size
+			if chunk is None:
+				local = np.transpose(np.ones((self.size, self.size)).nonzero())
+			else:
+				local = np.transpose((chunk == value).nonzero())
+			for r, c in local:
+				if self.in_bounds(top + r, left + c):
+					found.append((int(top + r), int(left + c)))
+		return found
@@ -0,0 +1,247 @@
+import hashlib
+import time
+import multiprocessing as mp
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from constraint import Problem, ExactSumConstraint
+
+from chunks import COVERED, MINE
+
+THRESHOLD = 10
+BUDGET = 2.0
+TABLE_SIZE = 100000
+
+class OutOfTime(Exception):
+	pass
+
+def bits(mask):
+	"""
+	Yields the index of every set bit in `mask`, lowest first.
+	"""
+	while mask:
+		low = mask & -mask
+		yield low.bit_length() - 1
+		mask ^= low
+
+class Endgame:
+	"""
+	Exact endgame search. Every placement of the remaining mines over the covered
+	tiles that agrees with the revealed numbers is enumerated, and the guess that
+	maximizes the probability of winning is found by searching every reveal and
+	the numbers it could show.
+
+	Positions are memoized in a bounded transposition table keyed by the covered
+	region as a bitmask and a 16 byte digest of its consistent mine placements,
+	which pins down the remaining mine count too. Tiles keep their bit for the
+	whole endgame, so positions explored on one move are found again on the next,
+	and a search that runs out of its per-move budget still leaves its finished
+	positions behind.
+	"""
+	def __init__(self, threshold=THRESHOLD, budget=BUDGET, table_size=TABLE_SIZE):
+		self.threshold = threshold
+		self.budget = budget
+		self.table_size = table_size
+		self.table = OrderedDict()
+		self.index = {}
+		self.stop = None
+		self.best = None
+
+	def active(self, covered):
+		# an unbounded board has no covered count and never reaches an endgame
+		return covered is not None and 0 < covered <= self.threshold
+
+	def best_move(self, tiles, vectors, mines):
+		"""
+		:param tiles: `chunks.ChunkedBoard` of the current position
+		:param vectors: list of vectors for the numbered tiles next to covered tiles
+		:param mines: number of mines still covered
+		:return: tuple of (coordinate, win probability), or None when there is
+			nothing to reveal. If the search runs out of time the best move found
+			so far is returned, with a probability of None if no move was scored.
+		"""
+		covered = tiles.find(COVERED)
+		self._reindex(covered)
+		self.coords = { i: c for c, i in self.index.items() }
+		self.neighbors = {}
+		self.flagged = {}
+		for c in covered:
+			i = self.index[c]
+			nc = tiles.neighbors(*c)
+			self.neighbors[i] = sum(1 << self.index[n] for n in nc if n in self.index and tiles[n] == COVERED)
+			self.flagged[i] = sum(1 for n in nc if tiles[n] == MINE)
+
+		mask = sum(1 << self.index[c] for c in covered)
+		configs = self.configurations(covered, vectors, mines)
+		if len(configs) == 0:
+			return None
+
+		self.stop = time.monotonic() + self.budget
+		self.best = None
+		try:
+			probability, move = self.search(mask, configs, root=True)
+		except OutOfTime:
+			if self.best is None:
+				return None
+			probability, move = self.best
+		if move is None:
+			return None
+		return self.coords[move], probability
+
+	def _reindex(self, covered):
+		"""
+		Keeps the existing bit of every tile while the covered region only
+		shrinks. A new endgame gets a fresh index and an empty table.
+		"""
+		if not set(covered) <= set(self.index):
+			self.index = { c: i for i, c in enumerate(sorted(covered)) }
+			self.table.clear()
+
+	def configurations(self, covered, vectors, mines):
+		"""
+		:return: frozenset of bitmasks, one per consistent placement of `mines`
+		"""
+		problem = Problem()
+		for c in covered:
+			problem.addVariable(str(c), [0,1])
+		for v in vectors:
+			variables = tuple([str(c) for c in v['vector']])
+			problem.addConstraint(ExactSumConstraint(v['mines']), variables)
+		problem.addConstraint(ExactSumConstraint(mines), tuple([str(c) for c in covered]))
+
+		configs = set()
+		for s in problem.getSolutions():
+			configs.add(sum(1 << self.index[c] for c in covered if s[str(c)]))
+		return frozenset(configs)
+
+	def reveal(self, tile, mask, config):
+		"""
+		Reveals `tile` under a mine placement, opening neighbors of any zero the
+		way the game does.
+		:return: tuple of (revealed bitmask, observed numbers)
+		"""
+		revealed = 0
+		observed = []
+		stack = [tile]
+		while stack:
+			t = stack.pop()
+			if revealed >> t & 1:
+				continue
+			revealed |= 1 << t
+			value = self.flagged[t] + bin(config & self.neighbors[t]).count('1')
+			observed.append((t, value))
+			if value == 0:
+				stack.extend(bits(self.neighbors[t] & mask & ~revealed))
+		return revealed, tuple(sorted(observed))
+
+	def outcome(self, tile, mask, configs):
+		"""
+		Win probability after revealing `tile`, averaged over what it could show.
+		"""
+		branches = {}
+		for config in configs:
+			if config >> tile & 1:
+				continue
+			revealed, observed = self.reveal(tile, mask, config)
+			branches.setdefault((revealed, observed), []).append(config)
+
+		wins = 0.0
+		for (revealed, _), branch in branches.items():
+			wins += len(branch) * self.search(mask & ~revealed, frozenset(branch))[0]
+		return wins / len(configs)
+
+	def key(self, mask, configs):
+		# every placement packed at the same width so they can't run together
+		width = (mask.bit_length() + 7) // 8 or 1
+		digest = hashlib.blake2b(digest_size=16)
+		for config in sorted(configs):
+			digest.update(config.to_bytes(width, 'little'))
+		return mask, digest.digest()
+
+	def search(self, mask, configs, root=False):
+		"""
+		:param root: track the best move at the root so a timed out search can
+			still answer
+		:return: tuple of (win probability, best tile index or None)
+		"""
+		key = self.key(mask, configs)
+		if key in self.table:
+			self.table.move_to_end(key)
+			return self.table[key]
+		if time.monotonic() > self.stop:
+			raise OutOfTime()
+
+		mines = 0
+		for config in configs:
+			mines |= config
+		safe = mask & ~mines
+		if bin(mask).count('1') == bin(next(iter(configs))).count('1'):
+			# only mines are left covered, the game is won
+			result = (1.0, None)
+		elif all(c == mines for c in configs):
+			result = (1.0, next(bits(safe)))
+		elif safe:
+			# revealing a tile that is always safe never lowers the odds
+			tile = next(bits(safe))
+			if root:
+				self.best = (None, tile)
+			result = (self.outcome(tile, mask, configs), tile)
+		else:
+			candidates = []
+			for tile in bits(mask):
+				n = sum(1 for c in configs if not c >> tile & 1)
+				if n > 0:
+					candidates.append((n, tile))
+			candidates.sort(reverse=True)
+
+			result = (0.0, None)
+			if root:
+				self.best = (None, candidates[0][1])
+			for n, tile in candidates:
+				# a guess can't win more often than it is safe
+				if n / len(configs) <= result[0]:
+					break
+				p = self.outcome(tile, mask, configs)
+				if p > result[0]:
+					result = (p, tile)
+					if root:
+						self.best = result
+
+		self.table[key] = result
+		if len(self.table) > self.table_size:
+			self.table.popitem(last=False)
+		return result
+
+
+_endgame = None
+
+def _start(threshold, budget, table_size):
+	global _endgame
+	_endgame = Endgame(threshold, budget, table_size)
+
+def _best_move(tiles, vectors, mines):
+	return _endgame.best_move(tiles, vectors, mines)
+
+class EndgameProcess:
+	"""
+	An `Endgame` that searches in a worker process of its own, so a long search
+	doesn't hold the caller's GIL. The process keeps its table between moves, so
+	use one per board.
+	"""
+	def __init__(self, threshold=THRESHOLD, budget=BUDGET, table_size=TABLE_SIZE):
+		self.threshold = threshold
+		self.executor = ProcessPoolExecutor(1, mp_context=mp.get_context('spawn'),
+											initializer=_start, initargs=(threshold, budget, table_size))
+
+	def active(self, covered):
+		# an unbounded board has no covered count and never reaches an endgame
+		return covered is not None and 0 < covered <= self.threshold
+
+	def best_move(self, tiles, vectors, mines):
+		"""
+		Same as `Endgame.best_move`, run in the worker process.
+		"""
+		return self.executor.submit(_best_move, tiles, vectors, mines).result()
+
+	def close(self):
+		self.executor.shutdown()
@@ -1,10 +1,18 @@
 import ast
+import itertools
 import networkx 
 from networkx.algorithms.components.connected import connected_components
 from constraint import *
 
 from utils import unique_vector_coordinates
 
+class SolverUnavailable(Exception):
+	"""
+	Raised by a session client that can't solve right now, e.g. a busy or
+	unreachable solver server. The session then solves in-process instead.
+	"""
+	pass
+
 def to_graph(l):
     G = networkx.Graph()
     for part in l:
@@ -105,4 +113,143 @@ class Solver:
 		for key in result.keys():
 			result[key] = result[key] / len(solutions)
 
+		return result
+
+	def get_distribution(self, vectors):
+		"""
+		Solves a cluster and tallies its solutions by the number of mines they
+		place, so the result can be cached and recombined later.
+		:param vectors: a list of vectors that form a cluster
+		:return: dict in the form { 2: {'solutions': 3, 'tiles': {(0,0): 1, ...}}, ... }
+		"""
+		uvc = unique_vector_coordinates(vectors)
+		problem = Problem()
+		self.add_variables(problem, uvc)
+		self.add_contraints(problem, vectors)
+		distribution = {}
+		for s in problem.getSolutions():
+			mines = sum(s.values())
+			entry = distribution.setdefault(mines, {'solutions': 0, 'tiles': {}})
+			entry['solutions'] += 1
+			for k,v in s.items():
+				t = ast.literal_eval(k)
+				entry['tiles'][t] = entry['tiles'].get(t, 0) + v
+		return distribution
+
+
+def combine_distribution(distribution):
+	"""
+	Returns probabilities of each coordinate being a mine from a cluster's mine
+	count distribution. Matches `Solver.combine_solutions` over the same solutions.
+	:return: dict of floats in form { (0,0): 0.253, ... }
+	"""
+	total = sum(entry['solutions'] for entry in distribution.values())
+	result = {}
+	for entry in distribution.values():
+		for k,v in entry['tiles'].items():
+			result[k] = result.get(k, 0) + v
+
+	for key in result.keys():
+		result[key] = result[key] / total
+
+	return result
+
+
+class Session:
+	"""
+	A long-lived solver that is kept between moves. Vectors are replaced only for
+	the roots that changed, and only the clusters they touch are re-grouped and
+	re-solved; every other cluster keeps its cached mine count distribution.
+	Pass a `service.SolverClient` to solve clusters on a local solver server
+	instead of in-process; if it raises `SolverUnavailable` the session solves
+	in-process for that call.
+	"""
+	def __init__(self, client=None):
+		self.client = client
+		self.vectors = {}
+		self.clusters = {}
+		self.cluster_of = {}
+		self.owner = {}
+		self.distributions = {}
+		self.ids = itertools.count()
+
+	def update(self, roots, vectors):
+		"""
+		Replaces the vectors of the given roots and regroups the affected clusters.
+		:param roots: set of root tuples whose vectors were rebuilt, e.g. every
+			numbered tile in or next to a changed tile
+		:param vectors: the new vectors for those roots; a root without a vector
+			here is removed
+		:return: None
+		"""
+		pending = {}
+		for root in roots:
+			if root in self.cluster_of:
+				self._dissolve(self.cluster_of[root], pending)
+		for root in roots:
+			pending.pop(root, None)
+			self.vectors.pop(root, None)
+		for v in vectors:
+			root = tuple(v['root'])
+			self.vectors[root] = v
+			pending[root] = v
+
+		# pull in any untouched cluster that shares a tile with a pending vector
+		work = list(pending.values())
+		while work:
+			v = work.pop()
+			for c in v['vector']:
+				cid = self.owner.get(c)
+				if cid is not None:
+					work = work + self._dissolve(cid, pending)
+
+		if len(pending) == 0:
+			return None
+		for cluster in Solver(list(pending.values())).clusters:
+			cid = next(self.ids)
+			self.clusters[cid] = cluster
+			for v in cluster:
+				self.cluster_of[tuple(v['root'])] = cid
+				for c in v['vector']:
+					self.owner[c] = cid
+		return None
+
+	def _dissolve(self, cid, pending):
+		"""
+		Drops a cluster and its cached result, moving its vectors to `pending`.
+		:return: list of the vectors that were moved
+		"""
+		cluster = self.clusters.pop(cid)
+		self.distributions.pop(cid, None)
+		for v in cluster:
+			root = tuple(v['root'])
+			del self.cluster_of[root]
+			pending[root] = v
+			for c in v['vector']:
+				if self.owner.get(c) == cid:
+					del self.owner[c]
+		return cluster
+
+	def solutions(self):
+		"""
+		Solves any cluster without a cached result and returns the probabilities
+		of every frontier tile.
+		:return: dict of floats in form { (0,0): 0.253, ... }
+		"""
+		missing = [ cid for cid in self.clusters if cid not in self.distributions ]
+		clusters = [ self.clusters[cid] for cid in missing ]
+		distributions = None
+		if self.client is not None:
+			try:
+				distributions = self.client.distributions(clusters)
+			except SolverUnavailable as e:
+				print('Solver service unavailable, solving locally:', e)
+		if distributions is None:
+			solver = Solver([])
+			distributions = [ solver.get_distribution(c) for c in clusters ]
+		self.distributions.update(zip(missing, distributions))
+
+		result = {}
+		for cid in self.clusters:
+			result.update(combine_distribution(self.distributions[cid]))
 		return result
\ No newline at end of file
@@ -6,11 +6,13 @@ from functools import partial
 
 from video import Screen
 from utils import unique_vector_coordinates, non_vector_coordinates
-from utils import sum_value_from_tuple_ndarray, coordinates, neighbor_coordinates
+from utils import sum_value_from_tuple_ndarray
 from utils import is_valid_state, check_scenario
 from utils_board import example_board
 
-from logic import Solver
+from logic import Session
+from chunks import ChunkedBoard
+from endgame import Endgame
 
 TYPES = {
 	'U'	: 'U',
@@ -33,9 +35,12 @@ class Board:
 	"""
 	A representation of a Minesweeper board.
 	"""
-	def __init__(self, rows, columns, mines, debug=False):
+	def __init__(self, rows, columns, mines, debug=False, client=None, screen=None, play=True):
 		"""
-		Initiates board of size rows by columns, with mines
+		Initiates board of size rows by columns, with mines. Pass a
+		`service.SolverClient` as client to solve on a local solver server. With
+		play=False the board waits for the caller to set `self.board` and call
+		`process_board`, as `multi.MultiBoard` does.
 		"""
 		self.debug = debug
 		self.rows = rows
@@ -43,9 +48,15 @@ class Board:
 		self.mines = mines
 		self.remaining_tiles = rows * columns
 		self.remaining_mines = mines
-		self.screen = Screen(rows, columns, debug)
+		self.screen = screen or Screen(rows, columns, debug)
+		self.session = Session(client)
+		self.vectors = {}
+		self.tiles = ChunkedBoard(rows, columns)
+		self.endgame = Endgame()
 		
-		if debug:
+		if not play:
+			self.board = None
+		elif debug:
 			self.board = np.array(example_board)
 			self.process_board()
 		else:
@@ -65,12 +76,6 @@ class Board:
 				if not self.process_board():
 					break
 
-	def _get_neighbor_values(self, board, neighbors):
-		"""
-		Return value of neighbors.
-		"""
-		return np.array([board[(coordinate)] for coordinate in neighbors])
-
 	def print_board(self):
 		"""
 		Prints a representation of the board.
@@ -84,8 +89,9 @@ class Board:
 		"""
 		Calculates the next best move.
 		"""
-		self.remaining_tiles = sum(sum( self.board == 'C' ))
-		self.remaining_mines = self.mines - sum([ sum(r == 'M') for r in self.board ])
+		self.tiles.update(self.board)
+		self.remaining_tiles = self.tiles.covered
+		self.remaining_mines = self.mines - self.tiles.flagged
 		if (self.remaining_mines == 0):
 			# self.print_board()
 			self.click_remaining_tiles()
@@ -101,47 +107,32 @@ class Board:
 		This is triggered when no mines are left on the board, so it's safe to click the
 		remaining tiles.
 		"""
-		safe = np.transpose((self.board == 'C').nonzero())
+		safe = self.tiles.find('C')
 		safe = [ self.screen.get_tile_coordinate(c) for c in safe ]
 		list(itertools.starmap(self.screen.left_click, safe))
 	
-	def _non_numerical_types(self):
-		return np.array([TYPES['U'],TYPES['M'],TYPES['C']])
+	def affected_roots(self, changed):
+		"""
+		A vector depends on its root and the root's neighbors, so every tile in or
+		next to a changed tile needs its vector rebuilt.
+		"""
+		roots = set(changed)
+		for coord in changed:
+			roots |= self.tiles.neighbors(*coord)
+		return roots
 
 	def create_vectors(self):
-		numbered_locations = np.transpose(np.isin(self.board, self._non_numerical_types(), invert=True).nonzero())
-		vectors = []
-		for location in numbered_locations:
-			
-			mines = int(self.board[tuple(location)])
-			nc = neighbor_coordinates(*location, self.board)
-			neighbor_values = self._get_neighbor_values(self.board, nc)
-			
-			valid_neighbors = []
-			valid_neighbor_values = []
-			for ix, coord in enumerate(nc):
-				if neighbor_values[ix] == 'M':
-					mines = mines - 1
-				elif neighbor_values[ix] == 'C':
-					valid_neighbors.append(coord)
-					valid_neighbor_values.append(neighbor_values[ix])
-			
-			nc = valid_neighbors
-			neighbor_values = np.array(valid_neighbor_values)
-
-			if len(nc) == 0:
-				continue
-			
-			if tuple(location) == (4,17):
-				print (location, nc, mines)
-
-			vectors.append({
-				'root': location,
-				'vector': nc,
-			 	'mines': mines
-			})
-
-		self.vectors = vectors
+		roots = self.affected_roots(self.tiles.changes())
+		new_vectors = []
+		for root in roots:
+			self.vectors.pop(root, None)
+			vector = self.tiles.vector(root)
+			if vector is not None:
+				self.vectors[root] = vector
+				new_vectors.append(vector)
+		self.session.update(roots, new_vectors)
+
+		vectors = list(self.vectors.values())
 		targets = []
 		mines = []
 		for vector in vectors:
@@ -183,6 +174,9 @@ class Board:
 		return mines / len(states)
 
 	def probabilities(self):
+		if self.endgame.active(self.remaining_tiles) and self.play_endgame():
+			return True
+
 		solution = self.solve()
 
 		list(itertools.starmap(self.screen.left_click, solution['safe']))
@@ -199,9 +193,25 @@ class Board:
 			return False
 
 
+	def play_endgame(self):
+		"""
+		Searches the remaining position exactly and reveals the tile with the best
+		chance of winning, or the best found so far if the search ran out of time.
+		Returns False if there was nothing to reveal.
+		"""
+		move = self.endgame.best_move(self.tiles, list(self.vectors.values()), self.remaining_mines)
+		if move is None:
+			return False
+		tile, probability = move
+		if probability is None:
+			print(f'Endgame: out of time, revealing {tile}')
+		else:
+			print(f'Endgame: revealing {tile}, win probability {probability:.3f}')
+		self.screen.left_click(*self.screen.get_tile_coordinate(tile))
+		return True
+
 	def solve(self):
-		solver = Solver(self.vectors)
-		solution = solver.solutions()
+		solution = self.session.solutions()
 		print(solution)
 		safe = [ self.screen.get_tile_coordinate(k) for k,v in solution.items() if v == 0.0 ]
 		mines = [ self.screen.get_tile_coordinate(k) for k,v in solution.items() if v == 1.0 ]
@@ -0,0 +1,191 @@
+import queue
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import mss
+import numpy as np
+
+from video import Screen, Actuator, classify
+from main import Board
+from service import SolverService
+from endgame import EndgameProcess
+
+class MultiBoard:
+	"""
+	Plays several boards tiled on one screen. Each frame the union of the boards
+	is grabbed once and every board reads its own slice of it. Every board runs
+	its own pipeline, taking the latest frame as soon as its previous clicks
+	have landed, so a slow board never holds up the others. The pure Python
+	work runs in other processes: a shared pool classifies tiles, a
+	`SolverService` solves clusters and each board searches its endgame in an
+	`EndgameProcess`. The board threads only coordinate, and all clicks go
+	through a single `Actuator` on the main thread, one batch per board.
+	"""
+	def __init__(self, layouts, debug=False, workers=None, client=None):
+		"""
+		:param layouts: list of dicts in the form
+			[{'rows': 16, 'columns': 30, 'mines': 170, 'top': 100, 'left': 100, 'height': 400}, ...]
+		:param client: solver client shared by the boards, by default a
+			`SolverService` started with `workers` processes
+		"""
+		self.debug = debug
+		self.service = None
+		if client is None:
+			self.service = client = SolverService(processes=workers)
+		self.boards = []
+		for layout in layouts:
+			screen = Screen(layout['rows'], layout['columns'], debug, top=layout['top'],
+							left=layout['left'], height=layout.get('height', 800), buffered=True)
+			board = Board(layout['rows'], layout['columns'], layout['mines'], debug,
+						  client=client, screen=screen, play=False)
+			board.endgame = EndgameProcess()
+			self.boards.append(board)
+
+		screens = [ b.screen for b in self.boards ]
+		top = min(s.top for s in screens)
+		left = min(s.left for s in screens)
+		self.mon = { "top": top,
+					 "left": left,
+					 "width": max(s.left + s.width for s in screens) - left,
+					 "height": max(s.top + s.height for s in screens) - top}
+		self.sct = mss.mss()
+		self.pool = ThreadPoolExecutor(len(self.boards))
+		# workers start lazily from board threads while the solver service's
+		# threads are running, so spawn them rather than fork a threaded process
+		self.classifier = ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'))
+		self.actuator = Actuator(debug)
+		self.processing = False
+		self.running = False
+		self.frames = threading.Condition()
+		self.frame = None
+		self.frame_id = 0
+		self.clicks = queue.Queue()
+		self.title = 'Minesweeper'
+
+	def grab(self):
+		"""
+		Grabs the union rectangle once for all boards.
+		"""
+		return np.asarray(self.sct.grab(self.mon))
+
+	def view(self, frame, screen):
+		"""
+		A board's slice of the frame. Slices are views into the same frame,
+		nothing is copied until a slice is sent to the classifier.
+		"""
+		top = screen.top - self.mon['top']
+		left = screen.left - self.mon['left']
+		return frame[top:top+screen.height, left:left+screen.width]
+
+	def publish(self, frame):
+		"""
+		Makes `frame` the latest frame and wakes any board waiting for one.
+		"""
+		with self.frames:
+			self.frame = frame
+			self.frame_id += 1
+			self.frames.notify_all()
+
+	def step(self, board):
+		"""
+		Classifies and solves one board. Runs on the board's own thread.
+		:return: tuple of (board, still playing, buffered clicks)
+		"""
+		screen = board.screen
+		screen.board = self.classifier.submit(classify, screen.board_raw, screen.rows, screen.columns).result()
+		board.board = screen.board
+		playing = board.process_board()
+		return board, playing, board.screen.take_clicks()
+
+	def run(self, board):
+		"""
+		One board's pipeline. It takes the latest frame grabbed after its last
+		clicks, steps, and hands the clicks to the main thread, without waiting
+		for the other boards.
+		"""
+		seen = 0
+		while True:
+			with self.frames:
+				self.frames.wait_for(lambda: not self.running or (self.processing and self.frame_id > seen))
+				if not self.running:
+					return
+				frame = self.frame
+			board.screen.board_raw = self.view(frame, board.screen)
+			board, playing, clicks = self.step(board)
+
+			done = threading.Event()
+			self.clicks.put((board, clicks, done))
+			while not done.wait(0.1):
+				if not self.running:
+					return
+			# frames grabbed before the clicks landed would show the old board
+			with self.frames:
+				seen = self.frame_id
+			if not playing:
+				return
+
+	def perform_clicks(self):
+		"""
+		Performs every click batch handed over since the last call, one board at
+		a time. Runs on the main thread, between grabs.
+		"""
+		while True:
+			try:
+				board, clicks, done = self.clicks.get_nowait()
+			except queue.Empty:
+				return
+			self.actuator.perform(board.screen, clicks)
+			done.set()
+
+	def capture(self):
+		frame = self.grab()
+		self.publish(frame)
+		cv2.imshow(self.title, frame)
+		key = cv2.waitKey(25) & 0xFF
+		if key == ord("q"):
+			cv2.destroyAllWindows()
+			return False
+		if key == ord("s"):
+			print("Processing Started")
+			self.processing = True
+		if key == ord("t"):
+			print("Processing Stopped")
+			self.processing = False
+		with self.frames:
+			self.frames.notify_all()
+		return True
+
+	def play(self):
+		"""
+		Runs until every board has finished or 'q' is pressed.
+		"""
+		self.running = True
+		pipelines = [ self.pool.submit(self.run, board) for board in self.boards ]
+		try:
+			while not all(p.done() for p in pipelines) and self.capture():
+				self.perform_clicks()
+		finally:
+			self.running = False
+			with self.frames:
+				self.frames.notify_all()
+			self.close()
+		for p in pipelines:
+			p.result()
+
+	def close(self):
+		self.pool.shutdown()
+		self.classifier.shutdown()
+		for board in self.boards:
+			board.endgame.close()
+		if self.service is not None:
+			self.service.close()
+
+
+if __name__ == "__main__":
+	layouts = [
+		{'rows': 16, 'columns': 30, 'mines': 170, 'top': 100, 'left': 100, 'height': 400},
+		{'rows': 16, 'columns': 30, 'mines': 170, 'top': 600, 'left': 100, 'height': 400},
+	]
+	MultiBoard(layouts).play()
@@ -0,0 +1,425 @@
+import ast
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+import multiprocessing as mp
+from collections import OrderedDict
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from chunks import ChunkedBoard
+from logic import Solver, SolverUnavailable, combine_distribution
+
+HOST = '127.0.0.1'
+PORT = 8765
+
+"""
+ENCODING
+"""
+
+def encode_vectors(vectors):
+	"""
+	:param vectors: list of vectors with tuple coordinates
+	:return: JSON friendly list of vectors with list coordinates
+	"""
+	return [{
+		'root': [int(x) for x in v['root']],
+		'vector': [[int(x) for x in c] for c in v['vector']],
+		'mines': int(v['mines'])
+	} for v in vectors]
+
+def decode_vectors(vectors):
+	"""
+	Inverse of `encode_vectors`.
+	"""
+	return [{
+		'root': tuple(v['root']),
+		'vector': [tuple(c) for c in v['vector']],
+		'mines': v['mines']
+	} for v in vectors]
+
+def encode_distribution(distribution):
+	return { str(k): {
+				'solutions': entry['solutions'],
+				'tiles': { str(t): n for t,n in entry['tiles'].items() }
+			} for k, entry in distribution.items() }
+
+def decode_distribution(distribution):
+	return { int(k): {
+				'solutions': entry['solutions'],
+				'tiles': { ast.literal_eval(t): n for t,n in entry['tiles'].items() }
+			} for k, entry in distribution.items() }
+
+def cluster_key(cluster):
+	"""
+	Roots don't change the solutions of a cluster, so two clusters with the same
+	vectors and mine counts share one key.
+	"""
+	return tuple(sorted((tuple(sorted(v['vector'])), v['mines']) for v in cluster))
+
+def board_vectors(board):
+	"""
+	:param board: list of rows in the form [['M','C','1',...,'X'],[...]]
+	:return: list of vectors for every numbered tile with covered neighbors
+	"""
+	board = np.array(board)
+	tiles = ChunkedBoard(*board.shape)
+	tiles.update(board)
+	vectors = [ tiles.vector(root) for root in tiles.changes() ]
+	return [ v for v in vectors if v is not None ]
+
+
+"""
+WORKERS
+"""
+
+def solve_cluster(cluster):
+	return Solver([]).get_distribution(cluster)
+
+
+class DeadlineExceeded(SolverUnavailable):
+	pass
+
+
+class Busy(SolverUnavailable):
+	pass
+
+
+class Task:
+	"""
+	One cluster solve, shared by every request that asks for the same cluster
+	while it is running.
+	"""
+	def __init__(self, distribution=None):
+		self.done = threading.Event()
+		self.distribution = distribution
+		self.error = None
+		self.started = time.monotonic()
+		if distribution is not None:
+			self.done.set()
+
+
+class Job:
+	def __init__(self, clusters, deadline):
+		self.clusters = clusters
+		self.deadline = deadline
+		self.queued = threading.Event()
+		self.tasks = None
+		self.error = None
+
+
+class SolverService:
+	"""
+	Batches cluster solves from concurrent requests onto a warm worker pool. A
+	bounded queue provides backpressure and each request carries a deadline.
+	A solve that outlives its request's deadline keeps running and is cached
+	when it finishes, and requests for a cluster that is already being solved
+	wait on that solve instead of starting another. At most `max_inflight`
+	distinct clusters are submitted to the pool at once; past that requests are
+	rejected instead of growing the pool's backlog.
+	"""
+	def __init__(self, processes=None, max_pending=64, batch_size=16, batch_window=0.005,
+				 cache_size=4096, deadline=5.0, max_inflight=None):
+		self.pool = mp.Pool(processes)
+		self.max_inflight = max_inflight or 4 * (processes or mp.cpu_count())
+		self.jobs = queue.Queue(max_pending)
+		self.batch_size = batch_size
+		self.batch_window = batch_window
+		self.cache = OrderedDict()
+		self.cache_size = cache_size
+		self.inflight = {}
+		self.deadline = deadline
+		self.lock = threading.Lock()
+		self.cache_lock = threading.Lock()
+		self.metrics = {
+			'requests': 0,
+			'rejected': 0,
+			'expired': 0,
+			'batches': 0,
+			'batched_requests': 0,
+			'clusters_solved': 0,
+			'cache_hits': 0,
+			'inflight_hits': 0,
+			'solve_seconds': 0.0,
+		}
+		self.running = True
+		self.batcher = threading.Thread(target=self._run, daemon=True)
+		self.batcher.start()
+
+	def close(self):
+		self.running = False
+		self.batcher.join()
+		self.pool.terminate()
+
+	def _count(self, key, n=1):
+		with self.lock:
+			self.metrics[key] += n
+
+	def snapshot(self):
+		with self.lock:
+			metrics = dict(self.metrics)
+		metrics['pending'] = self.jobs.qsize()
+		with self.cache_lock:
+			metrics['cached_clusters'] = len(self.cache)
+			metrics['inflight_clusters'] = len(self.inflight)
+		return metrics
+
+	def distributions(self, clusters, deadline=None):
+		"""
+		Queues clusters for solving and waits for their distributions.
+		:raises Busy: when too many requests or cluster solves are already pending
+		:raises DeadlineExceeded: when the deadline passes before they are solved
+		"""
+		if len(clusters) == 0:
+			return []
+		self._count('requests')
+		timeout = self.deadline if deadline is None else deadline
+		job = Job(clusters, time.monotonic() + timeout)
+		with self.cache_lock:
+			saturated = len(self.inflight) >= self.max_inflight
+		if not saturated:
+			try:
+				self.jobs.put_nowait(job)
+			except queue.Full:
+				saturated = True
+		if saturated:
+			self._count('rejected')
+			raise Busy('too many pending requests')
+
+		if not job.queued.wait(timeout):
+			self._count('expired')
+			raise DeadlineExceeded('deadline exceeded')
+		if job.error is not None:
+			self._count('rejected')
+			raise job.error
+		if job.tasks is None:
+			self._count('expired')
+			raise DeadlineExceeded('deadline exceeded')
+		for task in job.tasks:
+			if not task.done.wait(max(0, job.deadline - time.monotonic())):
+				self._count('expired')
+				raise DeadlineExceeded('deadline exceeded')
+			if task.error is not None:
+				raise task.error
+		return [ task.distribution for task in job.tasks ]
+
+	def solutions(self, vectors, deadline=None):
+		"""
+		:return: dict of floats in form { (0,0): 0.253, ... }, as `Solver.solutions()`
+		"""
+		result = {}
+		for d in self.distributions(Solver(vectors).clusters, deadline):
+			result.update(combine_distribution(d))
+		return result
+
+	def _next_batch(self):
+		try:
+			batch = [self.jobs.get(timeout=0.1)]
+		except queue.Empty:
+			return []
+		end = time.monotonic() + self.batch_window
+		while len(batch) < self.batch_size:
+			try:
+				batch.append(self.jobs.get(timeout=max(0, end - time.monotonic())))
+			except queue.Empty:
+				break
+		return batch
+
+	def _task(self, cluster):
+		"""
+		Returns the cached result, the running solve, or a newly submitted solve
+		for a cluster.
+		:raises Busy: when a new solve would exceed `max_inflight`
+		"""
+		key = cluster_key(cluster)
+		with self.cache_lock:
+			if key in self.cache:
+				self.cache.move_to_end(key)
+				self._count('cache_hits')
+				return Task(self.cache[key])
+			if key in self.inflight:
+				self._count('inflight_hits')
+				return self.inflight[key]
+			if len(self.inflight) >= self.max_inflight:
+				raise Busy('too many clusters being solved')
+			task = Task()
+			self.inflight[key] = task
+		self.pool.apply_async(solve_cluster, (cluster,),
+							  callback=partial(self._solved, key, task),
+							  error_callback=partial(self._failed, key, task))
+		return task
+
+	def _solved(self, key, task, distribution):
+		with self.cache_lock:
+			self.cache[key] = distribution
+			while len(self.cache) > self.cache_size:
+				self.cache.popitem(last=False)
+			self.inflight.pop(key, None)
+		self._count('clusters_solved')
+		self._count('solve_seconds', time.monotonic() - task.started)
+		task.distribution = distribution
+		task.done.set()
+
+	def _failed(self, key, task, error):
+		with self.cache_lock:
+			self.inflight.pop(key, None)
+		task.error = error
+		task.done.set()
+
+	def _run(self):
+		while self.running:
+			batch = self._next_batch()
+			now = time.monotonic()
+			live = []
+			for job in batch:
+				if job.deadline <= now:
+					job.queued.set()
+				else:
+					live.append(job)
+			if len(live) == 0:
+				continue
+			self._count('batches')
+			self._count('batched_requests', len(live))
+
+			# each distinct cluster in the batch is solved once
+			for job in live:
+				# don't start solves nobody is still waiting for
+				if job.deadline > time.monotonic():
+					try:
+						job.tasks = [ self._task(cluster) for cluster in job.clusters ]
+					except Busy as e:
+						job.error = e
+				job.queued.set()
+
+
+class Handler(BaseHTTPRequestHandler):
+	"""
+	GET  /metrics        counters as JSON
+	POST /solutions      {'vectors': [...]} or {'board': [[...]]} -> {'solutions': {'(0, 0)': 0.25}}
+	POST /distributions  {'clusters': [[...], ...]} -> {'distributions': [...]}
+	Both POSTs accept an optional 'deadline' in seconds.
+	"""
+	service = None
+
+	def _reply(self, status, body):
+		data = json.dumps(body).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self):
+		if self.path == '/metrics':
+			self._reply(200, self.service.snapshot())
+		else:
+			self._reply(404, {'error': 'not found'})
+
+	def do_POST(self):
+		length = int(self.headers.get('Content-Length', 0))
+		try:
+			body = json.loads(self.rfile.read(length))
+			deadline = body.get('deadline')
+			if self.path == '/solutions':
+				if 'board' in body:
+					vectors = board_vectors(body['board'])
+				else:
+					vectors = decode_vectors(body['vectors'])
+				solutions = self.service.solutions(vectors, deadline)
+				self._reply(200, {'solutions': { str(k): v for k,v in solutions.items() }})
+			elif self.path == '/distributions':
+				clusters = [ decode_vectors(c) for c in body['clusters'] ]
+				distributions = self.service.distributions(clusters, deadline)
+				self._reply(200, {'distributions': [ encode_distribution(d) for d in distributions ]})
+			else:
+				self._reply(404, {'error': 'not found'})
+		except Busy:
+			self._reply(503, {'error': 'too many pending requests'})
+		except DeadlineExceeded:
+			self._reply(504, {'error': 'deadline exceeded'})
+		except (ValueError, KeyError, TypeError) as e:
+			self._reply(400, {'error': str(e)})
+		except Exception as e:
+			# e.g. a worker failing to solve a cluster
+			self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+
+	def log_message(self, format, *args):
+		pass
+
+
+def serve(host=HOST, port=PORT, **kwargs):
+	"""
+	Runs a solver server until interrupted. Keyword arguments go to `SolverService`.
+	"""
+	service = SolverService(**kwargs)
+	handler = type('BoundHandler', (Handler,), {'service': service})
+	server = ThreadingHTTPServer((host, port), handler)
+	print(f'Solver service listening on http://{host}:{port}')
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		service.close()
+
+
+class SolverClient:
+	"""
+	Thin client for a running solver server. `logic.Session` and `Board` accept it
+	in place of solving in-process. A busy, late or unreachable server raises
+	`SolverUnavailable`, which the session answers by solving in-process.
+	"""
+	def __init__(self, url=f'http://{HOST}:{PORT}', timeout=10.0, deadline=None):
+		self.url = url.rstrip('/')
+		self.timeout = timeout
+		self.deadline = deadline
+
+	def _post(self, path, body):
+		if self.deadline is not None:
+			body['deadline'] = self.deadline
+		request = urllib.request.Request(self.url + path, data=json.dumps(body).encode(),
+										 headers={'Content-Type': 'application/json'})
+		try:
+			with urllib.request.urlopen(request, timeout=self.timeout) as response:
+				return json.loads(response.read())
+		except urllib.error.HTTPError as e:
+			if e.code in (503, 504):
+				raise SolverUnavailable(f'{e.code} {e.reason}')
+			raise
+		except (urllib.error.URLError, OSError) as e:
+			raise SolverUnavailable(str(e))
+
+	def distributions(self, clusters):
+		"""
+		:param clusters: list of clusters, each a list of vectors
+		:return: list of mine count distributions, one per cluster
+		"""
+		if len(clusters) == 0:
+			return []
+		body = self._post('/distributions', {'clusters': [ encode_vectors(c) for c in clusters ]})
+		return [ decode_distribution(d) for d in body['distributions'] ]
+
+	def solutions(self, vectors=None, board=None):
+		"""
+		:return: dict of floats in form { (0,0): 0.253, ... }, as `Solver.solutions()`
+		"""
+		if board is not None:
+			body = {'board': [ list(map(str, row)) for row in board ]}
+		else:
+			body = {'vectors': encode_vectors(vectors)}
+		solutions = self._post('/solutions', body)['solutions']
+		return { ast.literal_eval(k): v for k,v in solutions.items() }
+
+	def metrics(self):
+		with urllib.request.urlopen(self.url + '/metrics', timeout=self.timeout) as response:
+			return json.loads(response.read())
+
+
+if __name__ == "__main__":
+	serve()
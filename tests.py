@@ -1,9 +1,24 @@
+import threading
+import urllib.error
+import time
 import unittest
+from unittest import mock
 from test import support
 import numpy as np
 
 # from main import Board
 from utils import *
+from logic import Solver, Session, SolverUnavailable
+from chunks import ChunkedBoard
+from endgame import Endgame, EndgameProcess
+from service import SolverService, SolverClient, Handler, ThreadingHTTPServer, Job
+
+# the capture stack needs OpenCV, mss and pyautogui with a display
+try:
+	import video
+	from multi import MultiBoard
+except (ImportError, KeyError):
+	video = None
 
 class UtilsTest(unittest.TestCase):
 
@@ -70,5 +85,379 @@ class UtilsTest(unittest.TestCase):
 							   (2,1),(2,2)])
 		self.assertEqual(neighbor_coordinates(row, column, board), expected_result)
 
+class SessionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.vectors = [
+			{'root': (0,0), 'vector': [(0,1),(1,0),(1,1)], 'mines': 1},
+			{'root': (0,2), 'vector': [(0,1),(1,1),(1,2)], 'mines': 2},
+			{'root': (5,5), 'vector': [(4,4),(4,5)], 'mines': 1}]
+		self.session = Session()
+		self.session.update({tuple(v['root']) for v in self.vectors}, self.vectors)
+
+	def test_solutions_match_solver(self):
+		self.assertEqual(self.session.solutions(), Solver(self.vectors).solutions())
+
+	def test_update_keeps_untouched_clusters(self):
+		self.session.solutions()
+		kept = self.session.cluster_of[(5,5)]
+		self.session.update({(0,2)}, [{'root': (0,2), 'vector': [(0,1),(1,1),(1,2)], 'mines': 1}])
+		self.assertEqual(self.session.cluster_of[(5,5)], kept)
+		self.assertIn(kept, self.session.distributions)
+		self.assertEqual(len(self.session.distributions), 1)
+
+		vectors = [self.vectors[0], self.vectors[2],
+				   {'root': (0,2), 'vector': [(0,1),(1,1),(1,2)], 'mines': 1}]
+		self.assertEqual(self.session.solutions(), Solver(vectors).solutions())
+
+	def test_update_merges_clusters(self):
+		self.session.update({(3,4)}, [{'root': (3,4), 'vector': [(1,2),(4,4)], 'mines': 1}])
+		self.assertEqual(len(self.session.clusters), 1)
+
+	def test_update_removes_roots(self):
+		self.session.update({(5,5)}, [])
+		self.assertNotIn((4,4), self.session.solutions())
+
+class ChunkedBoardTest(unittest.TestCase):
+
+	def setUp(self):
+		self.board = ChunkedBoard(5, 7, size=3)
+
+	def test_update_allocates_on_demand(self):
+		b = np.full((5,7), 'C')
+		b[0,0] = '1'
+		b[4,6] = 'M'
+		self.board.update(b)
+		self.assertEqual(set(self.board.chunks.keys()), {(0,0),(1,2)})
+		self.assertEqual(self.board[(4,6)], 'M')
+		self.assertEqual(self.board[(2,2)], 'C')
+		self.assertEqual(self.board.changes(), {(0,0),(4,6)})
+		self.assertEqual(self.board.changes(), set())
+
+	def test_counts(self):
+		self.board[(1,1)] = '2'
+		self.board[(1,2)] = 'M'
+		self.assertEqual(self.board.covered, 33)
+		self.assertEqual(self.board.flagged, 1)
+		self.board[(1,2)] = 'C'
+		self.assertEqual(self.board.covered, 34)
+		self.assertEqual(self.board.flagged, 0)
+
+	def test_find(self):
+		self.board[(3,5)] = 'M'
+		self.assertEqual(self.board.find('M'), [(3,5)])
+		covered = self.board.find('C')
+		self.assertEqual(len(covered), 34)
+		self.assertEqual(set(covered), coordinates(5, 7) - {(3,5)})
+
+	def test_neighbors(self):
+		self.assertEqual(self.board.neighbors(0,0), {(0,1),(1,0),(1,1)})
+		unbounded = ChunkedBoard(size=3)
+		self.assertEqual(len(unbounded.neighbors(-5,-5)), 8)
+		unbounded[(-5,-5)] = '1'
+		self.assertEqual(unbounded[(-5,-5)], '1')
+		self.assertIsNone(unbounded.covered)
+		self.assertFalse(Endgame().active(unbounded.covered))
+		with self.assertRaises(ValueError):
+			unbounded.find('C')
+
+def serve(service):
+	handler = type('TestHandler', (Handler,), {'service': service})
+	server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+# a single cluster that takes a few tenths of a second to solve
+SLOW_CLUSTER = [
+	{'root': (0,0), 'vector': [(1,c) for c in range(14)], 'mines': 7},
+	{'root': (0,1), 'vector': [(1,c) for c in range(7)], 'mines': 3}]
+
+class ServiceTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.service = SolverService(processes=1)
+		cls.server, url = serve(cls.service)
+		cls.client = SolverClient(url)
+		cls.vectors = [
+			{'root': (0,0), 'vector': [(0,1),(1,0),(1,1)], 'mines': 1},
+			{'root': (0,2), 'vector': [(0,1),(1,1),(1,2)], 'mines': 2},
+			{'root': (5,5), 'vector': [(4,4),(4,5)], 'mines': 1}]
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+		cls.service.close()
+
+	def test_solutions(self):
+		self.assertEqual(self.client.solutions(self.vectors), Solver(self.vectors).solutions())
+
+	def test_board_solutions(self):
+		board = [['1','C'],['C','C']]
+		self.assertEqual(self.client.solutions(board=board),
+						 {(0,1): 1/3, (1,0): 1/3, (1,1): 1/3})
+
+	def test_session_client(self):
+		session = Session(self.client)
+		session.update({tuple(v['root']) for v in self.vectors}, self.vectors)
+		self.assertEqual(session.solutions(), Solver(self.vectors).solutions())
+		self.assertGreater(self.client.metrics()['requests'], 0)
+
+	def test_no_clusters(self):
+		requests = self.service.snapshot()['requests']
+		self.assertEqual(self.service.distributions([]), [])
+		self.assertEqual(self.service.snapshot()['requests'], requests)
+
+	def test_late_solve_is_cached(self):
+		late = SolverClient(self.client.url, deadline=0.01)
+		with self.assertRaises(SolverUnavailable):
+			late.distributions([SLOW_CLUSTER])
+		with self.assertRaises(SolverUnavailable):
+			late.distributions([SLOW_CLUSTER])
+		self.assertEqual(self.service.snapshot()['inflight_clusters'], 1)
+
+		distributions = self.client.distributions([SLOW_CLUSTER])
+		self.assertEqual(distributions, [Solver([]).get_distribution(SLOW_CLUSTER)])
+		metrics = self.service.snapshot()
+		self.assertEqual(metrics['inflight_clusters'], 0)
+		self.assertGreaterEqual(metrics['inflight_hits'], 2)
+		self.assertEqual(self.client.distributions([SLOW_CLUSTER]), distributions)
+
+def slow_cluster(offset):
+	return [ dict(v, vector=[(r, c + offset) for r, c in v['vector']]) for v in SLOW_CLUSTER ]
+
+class ServiceErrorTest(unittest.TestCase):
+
+	def setUp(self):
+		self.service = SolverService(processes=1)
+		self.server, url = serve(self.service)
+		self.url = url
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.service.close()
+
+	def test_worker_error_replies_500(self):
+		# stands in for an unexpected failure re-raised from a worker
+		with mock.patch.object(self.service, 'distributions', side_effect=RuntimeError('boom')):
+			with self.assertRaises(urllib.error.HTTPError) as e:
+				SolverClient(self.url).distributions([[{'root': (0,0), 'vector': [(0,1)], 'mines': 1}]])
+		self.assertEqual(e.exception.code, 500)
+		self.assertIn('RuntimeError: boom', e.exception.read().decode())
+
+class ServiceOverloadTest(unittest.TestCase):
+
+	def setUp(self):
+		self.service = SolverService(processes=1, max_inflight=1)
+		self.server, url = serve(self.service)
+		self.client = SolverClient(url, deadline=0.05)
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.service.close()
+
+	def test_inflight_solves_are_bounded(self):
+		errors = []
+		def request(offset):
+			try:
+				self.client.distributions([slow_cluster(offset)])
+			except SolverUnavailable as e:
+				errors.append(str(e))
+		threads = [ threading.Thread(target=request, args=(i,)) for i in range(10) ]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		metrics = self.service.snapshot()
+		self.assertLessEqual(metrics['inflight_clusters'], 1)
+		self.assertEqual(len(errors), 10)
+		self.assertGreaterEqual(sum('503' in e for e in errors), 8)
+		self.assertEqual(metrics['rejected'], sum('503' in e for e in errors))
+
+class ServiceUnavailableTest(unittest.TestCase):
+
+	def setUp(self):
+		# stop the batcher so queued requests are never picked up
+		self.service = SolverService(processes=1, max_pending=1)
+		self.service.running = False
+		self.service.batcher.join()
+		self.server, url = serve(self.service)
+		self.client = SolverClient(url, deadline=0.05)
+		self.vectors = [{'root': (0,0), 'vector': [(0,1),(1,0),(1,1)], 'mines': 1}]
+		self.session = Session(self.client)
+		self.session.update({(0,0)}, self.vectors)
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.service.pool.terminate()
+
+	def test_deadline_exceeded(self):
+		with self.assertRaisesRegex(SolverUnavailable, '504'):
+			self.client.distributions([self.vectors])
+		self.assertEqual(self.service.snapshot()['expired'], 1)
+
+	def test_busy(self):
+		self.service.jobs.put(Job([], time.monotonic()))
+		with self.assertRaisesRegex(SolverUnavailable, '503'):
+			self.client.distributions([self.vectors])
+		self.assertEqual(self.service.snapshot()['rejected'], 1)
+
+	def test_session_falls_back(self):
+		# times out and leaves its request in the queue, so the next one is rejected
+		self.assertEqual(self.session.solutions(), Solver(self.vectors).solutions())
+		self.session.update({(0,0)}, [{'root': (0,0), 'vector': [(0,1),(1,0)], 'mines': 1}])
+		self.assertEqual(self.session.solutions(), {(0,1): 0.5, (1,0): 0.5})
+		metrics = self.service.snapshot()
+		self.assertEqual((metrics['expired'], metrics['rejected']), (1, 1))
+
+	def test_unreachable(self):
+		self.server.shutdown()
+		self.server.server_close()
+		with self.assertRaises(SolverUnavailable):
+			self.client.distributions([self.vectors])
+
+class EndgameTest(unittest.TestCase):
+
+	def setUp(self):
+		self.endgame = Endgame()
+
+	def test_safe_tile(self):
+		tiles = ChunkedBoard(1, 3)
+		tiles[(0,0)] = '1'
+		move = self.endgame.best_move(tiles, [tiles.vector((0,0))], 1)
+		self.assertEqual(move, ((0,2), 1.0))
+
+	def test_best_guess(self):
+		# every tile is equally likely to be safe, but a safe corner always
+		# tells where the mine is
+		tiles = ChunkedBoard(1, 3)
+		tile, probability = self.endgame.best_move(tiles, [], 1)
+		self.assertIn(tile, {(0,0),(0,2)})
+		self.assertAlmostEqual(probability, 2/3)
+
+	def test_table_is_reused(self):
+		tiles = ChunkedBoard(1, 3)
+		tile, _ = self.endgame.best_move(tiles, [], 1)
+		size = len(self.endgame.table)
+		tiles[tile] = '1'
+		self.endgame.best_move(tiles, [tiles.vector(tile)], 1)
+		self.assertEqual(len(self.endgame.table), size)
+
+	def test_process(self):
+		endgame = EndgameProcess()
+		try:
+			tiles = ChunkedBoard(1, 3)
+			self.assertEqual(endgame.best_move(tiles, [], 1), self.endgame.best_move(tiles, [], 1))
+		finally:
+			endgame.close()
+
+	def test_out_of_time(self):
+		self.endgame.budget = -1
+		self.assertIsNone(self.endgame.best_move(ChunkedBoard(1, 3), [], 1))
+
+	def test_out_of_time_keeps_best_root_move(self):
+		# 2x7 with 4 mines can't be finished in a short budget
+		self.endgame.budget = 0.2
+		tiles = ChunkedBoard(2, 7)
+		tile, probability = self.endgame.best_move(tiles, [], 4)
+		self.assertIn(tile, tiles.find('C'))
+		self.assertTrue(probability is None or 0 < probability < 1)
+
+	def test_table_keys_are_compact(self):
+		self.endgame.best_move(ChunkedBoard(2, 4), [], 2)
+		for mask, digest in self.endgame.table.keys():
+			self.assertIsInstance(mask, int)
+			self.assertEqual(len(digest), 16)
+
+@unittest.skipIf(video is None, 'capture stack unavailable')
+class MultiBoardTest(unittest.TestCase):
+
+	def setUp(self):
+		layouts = [
+			{'rows': 2, 'columns': 3, 'mines': 1, 'top': 100, 'left': 50, 'height': 20},
+			{'rows': 2, 'columns': 2, 'mines': 1, 'top': 130, 'left': 90, 'height': 20}]
+		with mock.patch('multi.mss'):
+			self.multi = MultiBoard(layouts, workers=1)
+		self.frame = np.arange(60 * 80 * 4, dtype=np.uint8).reshape(60, 80, 4)
+		self.multi.sct.grab.return_value = self.frame
+
+	def tearDown(self):
+		self.multi.close()
+
+	def test_buffered_clicks(self):
+		screen = self.multi.boards[0].screen
+		self.assertIsNone(screen.sct)
+		screen.left_click(1, 2)
+		screen.right_click(3, 4)
+		self.assertEqual(screen.take_clicks(), [('left', 1, 2), ('right', 3, 4)])
+		self.assertEqual(screen.take_clicks(), [])
+
+	def test_grab_slices(self):
+		self.assertEqual(self.multi.mon, {'top': 100, 'left': 50, 'width': 60, 'height': 50})
+		frame = self.multi.grab()
+		first, second = [ self.multi.view(frame, b.screen) for b in self.multi.boards ]
+		self.assertEqual(first.shape, (20, 30, 4))
+		self.assertEqual(second.shape, (20, 20, 4))
+		self.assertTrue(np.array_equal(second, frame[30:50, 40:60]))
+		self.assertTrue(np.shares_memory(first, frame))
+		self.assertTrue(np.shares_memory(second, frame))
+
+	def test_actuator_batches(self):
+		first, second = [ b.screen for b in self.multi.boards ]
+		with mock.patch('video.pyautogui') as gui:
+			actuator = video.Actuator(False)
+			actuator.perform(first, [('left', 1, 1), ('right', 2, 2)])
+			actuator.perform(second, [])
+			actuator.perform(second, [('left', 3, 3)])
+		self.assertEqual(gui.click.call_args_list, [
+			mock.call(x=first.left+first.width+50, y=first.top-50),
+			mock.call(button='left', x=1, y=1),
+			mock.call(button='right', x=2, y=2),
+			mock.call(x=second.left+second.width+50, y=second.top-50),
+			mock.call(button='left', x=3, y=3)])
+
+	def test_step_classifies_on_process_pool(self):
+		board = self.multi.boards[0]
+		# every pixel the covered tile color
+		board.screen.board_raw = np.full((20, 30, 4), (229, 229, 229, 255), dtype=np.uint8)
+		classifier = self.multi.classifier
+		with mock.patch.object(classifier, 'submit', wraps=classifier.submit) as submit:
+			_, playing, clicks = self.multi.step(board)
+		self.assertIs(submit.call_args[0][0], video.classify)
+		self.assertEqual(board.board.tolist(), [['C'] * 3] * 2)
+		self.assertEqual(board.remaining_tiles, 6)
+		self.assertTrue(playing)
+		self.assertEqual(len(clicks), 1)
+
+	def test_boards_run_independently(self):
+		slow, fast = self.multi.boards
+		steps = {id(slow): 0, id(fast): 0}
+		def step(board):
+			if board is slow:
+				time.sleep(0.5)
+			steps[id(board)] += 1
+			return board, True, [('left', 1, 1)]
+		frames = iter(range(40))
+		def capture():
+			if next(frames, None) is None:
+				return False
+			self.multi.publish(self.frame)
+			time.sleep(0.02)
+			return True
+
+		self.multi.processing = True
+		with mock.patch.object(self.multi, 'step', side_effect=step), \
+			 mock.patch.object(self.multi, 'capture', side_effect=capture), \
+			 mock.patch.object(self.multi.actuator, 'perform') as perform:
+			self.multi.play()
+		self.assertGreater(steps[id(fast)], 5 * steps[id(slow)])
+		# a batch handed over after the last frame is dropped on quit
+		self.assertGreaterEqual(perform.call_count, steps[id(fast)] + steps[id(slow)] - 2)
+
 if __name__ == '__main__':
 	unittest.main(verbosity=2)
\ No newline at end of file
@@ -13,22 +13,31 @@ import os
 pyautogui.FAILSAFE = True
 
 class Screen:
-	def __init__(self, rows, columns, debug):
+	def __init__(self, rows, columns, debug, top=600, left=600, height=800, buffered=False):
+		"""
+		With buffered=True clicks are collected in `self.clicks` instead of being
+		performed, so an `Actuator` can perform them later.
+		"""
 		self.debug = debug
 		self.rows = rows
 		self.columns = columns
-		self.top = 600
-		self.left = 600
-		self.height = 800
+		self.top = top
+		self.left = left
+		self.height = height
+		self.buffered = buffered
+		self.clicks = []
 		self.width = int(self.height * (columns / rows))
 		self.board = None
 		self.board_raw = None
 		self.processing = False
-		self.mon = { "top": self.top,
-					 "left": self.left,
-					 "width": self.width, 
-					 "height": self.height}
-		self.sct = mss.mss()
+		self.mon = None
+		self.sct = None
+		if not buffered:
+			self.mon = { "top": self.top,
+						 "left": self.left,
+						 "width": self.width, 
+						 "height": self.height}
+			self.sct = mss.mss()
 		self.title = 'Minesweeper'
 
 
@@ -50,21 +59,7 @@ class Screen:
 
 
 	def process(self):
-
-		self.board = []
-		for row in np.array_split(self.board_raw, self.rows, axis=0):
-			row_tiles = []
-			for cell in np.array_split(row, self.columns, axis=1):
-				# vertical line centered
-				y,x,c = cell.shape
-				startx = x//2
-				middle = []
-				for row in cell:
-					middle.append(row[startx])
-				tile = self.classify_cell(np.array(middle))
-				row_tiles.append(tile)
-			self.board.append(row_tiles)
-		self.board = np.array(self.board)
+		self.board = classify(self.board_raw, self.rows, self.columns)
 		# self.print_board(20,20)
 
 	def get_tile_coordinate(self, rc):
@@ -81,7 +76,9 @@ class Screen:
 		pyautogui.click(x=self.left+self.width+buf, y=self.top-buf)
 
 	def left_click(self, left, top):
-		if self.debug:
+		if self.buffered:
+			self.clicks.append(('left', left, top))
+		elif self.debug:
 			print('Simulated click at', (left, top))
 			pass
 		else:
@@ -89,13 +86,23 @@ class Screen:
 			pyautogui.click(x=left, y=top)
 
 	def right_click(self, left, top):
-		if self.debug:
+		if self.buffered:
+			self.clicks.append(('right', left, top))
+		elif self.debug:
 			print('Simulated click at', (left, top))
 			pass
 		else:
 			self.click_to_activate()
 			pyautogui.click(button='right', x=left, y=top)
 
+	def take_clicks(self):
+		"""
+		Returns and clears the buffered clicks.
+		"""
+		clicks = self.clicks
+		self.clicks = []
+		return clicks
+
 	def print_board(self, tiles, mines, board=[]):
 		"""
 		Prints a representation of the Minesweeper board.
@@ -109,60 +116,103 @@ class Screen:
 			print(' '.join(row))
 		print(f'Remaining Tiles:{tiles}, Remaining Mines: {mines}')
 
-	def classify_cell(self, cell):
-
-		# bgr
-		colors = {
-			'C': '[229 229 229]',
-			'U': '[218 218 218]',
-			'1': '[255   0   0]',
-			'2': '[  0 128   0]',
-			'3': '[  0   0 255]',
-			'4': '[128   0   0]',
-			'5': '[  0   0 128]',
-			'6': '[128 128   0]',
-			'7': '[0 0 0]',
-			'8': '[XXX XXX XXX]',
-		}
-
-		c = {}
-		for pixel in np.reshape(cell, (-1,4)):
-			s = str(pixel[:3])
-			c[s] = c.get(s, 0) + 1
-		if '[153 153 153]' in c:
-			del c['[153 153 153]']
-		if '[255 255 255]' in c:
-			del c['[255 255 255]']
-		k = Counter(c)
-		high = k.most_common(4)
-		top = {}
-		for h in high:
-			top[h[0]] = round(h[1] / (cell.size / 4),4)
-		# print(top)
-		if colors['3'] in top and colors['7'] in top and top[colors['7']] >= 0.050:
-			return 'M'
-		if colors['1'] in top and top[colors['1']] >= 0.050:
-			return '1'
-		elif colors['2'] in top and top[colors['2']] >= 0.075:
-			return '2'
-		elif colors['3'] in top and top[colors['3']] >= 0.075:
-			return '3'
-		elif colors['4'] in top and top[colors['4']] >= 0.075:
-			return '4'
-		elif colors['5'] in top and top[colors['5']] >= 0.075:
-			return '5'
-		elif colors['6'] in top and top[colors['6']] >= 0.075:
-			return '6'
-		elif colors['7'] in top and top[colors['7']] >= 0.075:
-			return '7'
-		elif colors['8'] in top and top[colors['8']] >= 0.075:
-			return '8'
-		elif colors['U'] in top and top[colors['U']] >= 0.50:
-			return 'U'
-		elif colors['C'] in top and top[colors['C']] >= 0.45:
-			return 'C'
-		else:
-			return 'X'
+
+def classify(board_raw, rows, columns):
+	"""
+	Classifies every tile of a captured board. A plain function so it can run on
+	a process pool.
+	:param board_raw: BGRA image of the board
+	:return: numpy array in the form [['M','C','1',...,'X'],[...]]
+	"""
+	board = []
+	for row in np.array_split(board_raw, rows, axis=0):
+		row_tiles = []
+		for cell in np.array_split(row, columns, axis=1):
+			# vertical line centered
+			y,x,c = cell.shape
+			startx = x//2
+			middle = []
+			for row in cell:
+				middle.append(row[startx])
+			tile = classify_cell(np.array(middle))
+			row_tiles.append(tile)
+		board.append(row_tiles)
+	return np.array(board)
+
+def classify_cell(cell):
+
+	# bgr
+	colors = {
+		'C': '[229 229 229]',
+		'U': '[218 218 218]',
+		'1': '[255   0   0]',
+		'2': '[  0 128   0]',
+		'3': '[  0   0 255]',
+		'4': '[128   0   0]',
+		'5': '[  0   0 128]',
+		'6': '[128 128   0]',
+		'7': '[0 0 0]',
+		'8': '[XXX XXX XXX]',
+	}
+
+	c = {}
+	for pixel in np.reshape(cell, (-1,4)):
+		s = str(pixel[:3])
+		c[s] = c.get(s, 0) + 1
+	if '[153 153 153]' in c:
+		del c['[153 153 153]']
+	if '[255 255 255]' in c:
+		del c['[255 255 255]']
+	k = Counter(c)
+	high = k.most_common(4)
+	top = {}
+	for h in high:
+		top[h[0]] = round(h[1] / (cell.size / 4),4)
+	# print(top)
+	if colors['3'] in top and colors['7'] in top and top[colors['7']] >= 0.050:
+		return 'M'
+	if colors['1'] in top and top[colors['1']] >= 0.050:
+		return '1'
+	elif colors['2'] in top and top[colors['2']] >= 0.075:
+		return '2'
+	elif colors['3'] in top and top[colors['3']] >= 0.075:
+		return '3'
+	elif colors['4'] in top and top[colors['4']] >= 0.075:
+		return '4'
+	elif colors['5'] in top and top[colors['5']] >= 0.075:
+		return '5'
+	elif colors['6'] in top and top[colors['6']] >= 0.075:
+		return '6'
+	elif colors['7'] in top and top[colors['7']] >= 0.075:
+		return '7'
+	elif colors['8'] in top and top[colors['8']] >= 0.075:
+		return '8'
+	elif colors['U'] in top and top[colors['U']] >= 0.50:
+		return 'U'
+	elif colors['C'] in top and top[colors['C']] >= 0.45:
+		return 'C'
+	else:
+		return 'X'
+
+
+class Actuator:
+	"""
+	The single mouse shared by several boards. Each board's clicks are performed
+	as one uninterrupted batch, after activating that board's window.
+	"""
+	def __init__(self, debug):
+		self.debug = debug
+
+	def perform(self, screen, clicks):
+		if len(clicks) == 0:
+			return
+		if self.debug:
+			for button, left, top in clicks:
+				print('Simulated', button, 'click at', (left, top))
+			return
+		screen.click_to_activate()
+		for button, left, top in clicks:
+			pyautogui.click(button=button, x=left, y=top)
 
 
 # screen = Screen(9, 9)
\ No newline at end of file